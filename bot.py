@@ -1,13 +1,26 @@
 import os
 import asyncio
+import heapq
 import logging
+import queue
 import random
+import re
+import sys
+import time
 from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
-from contextlib import contextmanager
+from collections import namedtuple
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 
-import psycopg
-from psycopg.rows import dict_row
+try:
+    import orjson  # optional: faster parsing of Telegram's replies, see OrjsonRequest
+except ImportError:
+    orjson = None
+
+from psycopg.rows import dict_row, scalar_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
 
 from telegram import (
     Update,
@@ -15,6 +28,9 @@ from telegram import (
     InlineKeyboardMarkup,
 )
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -29,7 +45,13 @@ from telegram.ext import (
 # ======================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
-ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()}
+# public https base URL for webhook mode (e.g. behind a reverse proxy). Webhook mode is the "web"
+# entry in Procfile.txt (`--webhook`), long polling the "worker" entry; scale the other one to 0.
+WEBHOOK_MODE = "--webhook" in sys.argv[1:]
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+PORT = int(os.getenv("PORT", "8443"))
+ADMIN_IDS = frozenset(int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit())
 
 TZ = ZoneInfo("America/Argentina/Ushuaia")
 
@@ -39,10 +61,33 @@ MAX_LEVEL = 4
 
 MIN_WITHDRAW_USD_CENTS = 500  # $5.00
 
+# how long a rendered "📅 Tareas" view is reused for repeated opens
+TASKS_VIEW_TTL_S = float(os.getenv("TASKS_VIEW_TTL_S", "10"))
+# how long a users row read for saldo/nivel is reused
+USER_CACHE_TTL_S = float(os.getenv("USER_CACHE_TTL_S", "30"))
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# how long a handler waits for a free connection before giving up with PoolTimeout
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "10"))
+# updates handled in parallel (PTB default is one at a time); DB work still queues on the pool
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
 if not BOT_TOKEN:
     raise RuntimeError("Falta BOT_TOKEN en variables de entorno")
 if not DATABASE_URL:
     raise RuntimeError("Falta DATABASE_URL en variables de entorno")
+if WEBHOOK_MODE and not WEBHOOK_URL:
+    raise RuntimeError("Falta WEBHOOK_URL en variables de entorno (requerido con --webhook)")
+if WEBHOOK_URL and not WEBHOOK_MODE:
+    # polling would delete the webhook a --webhook process relies on
+    raise RuntimeError("WEBHOOK_URL está definido: iniciá con --webhook o quitá la variable")
+if WEBHOOK_MODE and not WEBHOOK_SECRET:
+    # without it the webhook would listen on "/" and accept updates from anyone
+    raise RuntimeError("Falta WEBHOOK_SECRET en variables de entorno (requerido con --webhook)")
+if WEBHOOK_MODE and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+    # Telegram only accepts these characters in secret_token
+    raise RuntimeError("WEBHOOK_SECRET inválido: 1-256 caracteres A-Z, a-z, 0-9, _ o -")
 
 # ======================
 # HELPERS
@@ -50,66 +95,140 @@ if not DATABASE_URL:
 def now_local() -> datetime:
     return datetime.now(TZ)
 
-def today_local() -> date:
-    return now_local().date()
+# (monotonic stamp, date): handlers ask for today many times per second
+_TODAY_CACHE = (float("-inf"), None)
 
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+def today_local() -> date:
+    """Local date, recomputed at most once per second (rollover is seen within 1s)."""
+    global _TODAY_CACHE
+    now = time.monotonic()
+    ts, d = _TODAY_CACHE
+    if now - ts >= 1.0:
+        d = now_local().date()
+        _TODAY_CACHE = (now, d)
+    return d
+
+# bound frozenset lookup: no Python-level frame per admin check
+is_admin = ADMIN_IDS.__contains__
 
 def format_usd_from_cents(cents: int) -> str:
     return f"${cents/100:.2f}"
 
-def compute_level(streak_days: int) -> int:
-    lvl = 1 + (max(0, streak_days) // LEVEL_STEP_DAYS)
-    return min(max(lvl, 1), MAX_LEVEL)
+# opened in init_db, closed in close_db
+POOL = AsyncConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT_S,
+    # keepalives so a silently dropped idle connection is noticed; libpq already sets TCP_NODELAY
+    kwargs={"row_factory": dict_row, "keepalives": 1, "keepalives_idle": 30},
+    open=False,
+)
 
-@contextmanager
-def db_conn():
-    """Single place to configure connections (easy to change pool later)."""
-    conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
-    try:
+@asynccontextmanager
+async def db_conn():
+    """
+    Single place to get a connection, borrowed from POOL. The block is one
+    transaction: committed on clean exit, rolled back on error.
+    Keep Telegram calls outside the block so connections are held only
+    for SQL and the pool can stay small under bursts.
+    """
+    async with POOL.connection() as conn:
         yield conn
-    finally:
-        conn.close()
 
-async def run_db(fn):
-    """Run sync DB work in a thread and return its value."""
-    return await asyncio.to_thread(fn)
+@asynccontextmanager
+async def db_autocommit():
+    """
+    Like db_conn but in autocommit, for blocks that run one statement (a
+    read, or a single server-side function call, which is atomic on its
+    own): no BEGIN/COMMIT round trips. The connection goes back to
+    transaction mode before it returns to the pool.
+    """
+    async with POOL.connection() as conn:
+        await conn.set_autocommit(True)
+        try:
+            yield conn
+        finally:
+            await conn.set_autocommit(False)
+
+async def fetch_scalar(cur, query: str, params=(), prepare=None):
+    """First column of the first row (or None), without building a dict row."""
+    async with cur.connection.cursor(row_factory=scalar_row) as scur:
+        await scur.execute(query, params, prepare=prepare)
+        return await scur.fetchone()
 
 # ======================
 # UI MENUS
 # ======================
+# keyboards are immutable: build the constant ones once at import
+_MENU_ROWS = (
+    (InlineKeyboardButton("📅 Tareas", callback_data="menu:tareas"),
+     InlineKeyboardButton("💰 Saldo", callback_data="menu:saldo")),
+    (InlineKeyboardButton("🏅 Nivel", callback_data="menu:nivel"),
+     InlineKeyboardButton("💸 Retirar", callback_data="menu:retirar")),
+    (InlineKeyboardButton("📜 Historial", callback_data="menu:historial"),
+     InlineKeyboardButton("ℹ️ Ayuda", callback_data="menu:ayuda")),
+)
+_MENU_USER = InlineKeyboardMarkup(_MENU_ROWS)
+_MENU_ADMIN = InlineKeyboardMarkup(_MENU_ROWS + ((InlineKeyboardButton("⚙️ Admin", callback_data="admin:panel"),),))
+_BACK = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Menú", callback_data="menu:home")]])
+
 def inline_menu(user_id: int) -> InlineKeyboardMarkup:
-    buttons = [
-        [InlineKeyboardButton("📅 Tareas", callback_data="menu:tareas"),
-         InlineKeyboardButton("💰 Saldo", callback_data="menu:saldo")],
-        [InlineKeyboardButton("🏅 Nivel", callback_data="menu:nivel"),
-         InlineKeyboardButton("💸 Retirar", callback_data="menu:retirar")],
-        [InlineKeyboardButton("📜 Historial", callback_data="menu:historial"),
-         InlineKeyboardButton("ℹ️ Ayuda", callback_data="menu:ayuda")],
-    ]
-    if is_admin(user_id):
-        buttons.append([InlineKeyboardButton("⚙️ Admin", callback_data="admin:panel")])
-    return InlineKeyboardMarkup(buttons)
+    return _MENU_ADMIN if user_id in ADMIN_IDS else _MENU_USER
 
 def back_to_menu(user_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Menú", callback_data="menu:home")]])
+    return _BACK
+
+# daily_tasks.type is stored lowercase, so reads compare it as-is
+LINK_TYPES = frozenset({"link", "campaign_link"})
 
+# trailing "📅 Ver tareas / 🏠 Menú" row shared by the per-task keyboards
+_NAV_ROW = (
+    InlineKeyboardButton("📅 Ver tareas", callback_data="menu:tareas"),
+    InlineKeyboardButton("🏠 Menú", callback_data="menu:home"),
+)
+
+@lru_cache(maxsize=64)  # one markup per task position
 def next_after_task_kb(after_idx: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("➡️ Siguiente tarea", callback_data=f"task:next:{after_idx}")],
-        [InlineKeyboardButton("📅 Ver tareas", callback_data="menu:tareas"),
-         InlineKeyboardButton("🏠 Menú", callback_data="menu:home")],
+        _NAV_ROW,
+    ])
+
+@lru_cache(maxsize=256)  # one markup per daily task
+def next_task_kb(ttype: str, task_id: int, link_url: str | None) -> InlineKeyboardMarkup:
+    if ttype in LINK_TYPES:
+        first = [InlineKeyboardButton("🔗 Abrir", url=(link_url or "")),
+                 InlineKeyboardButton("✅ Confirmar", callback_data=f"task:confirm:{task_id}")]
+    elif ttype == "checkin":
+        first = [InlineKeyboardButton("✅ Completar", callback_data=f"task:do:{task_id}")]
+    elif ttype == "quiz":
+        first = [InlineKeyboardButton("🧠 Responder", callback_data=f"task:quiz:{task_id}")]
+    else:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("📅 Ver tareas", callback_data="menu:tareas")]])
+    return InlineKeyboardMarkup([
+        first,
+        _NAV_ROW,
     ])
 
 # ======================
 # DB INIT
 # ======================
+# bump whenever the DDL below changes; warm boots with a matching version skip it
+SCHEMA_VERSION = "6"
+
 async def init_db(app: Application):
-    def _setup():
-        with db_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
+    await POOL.open(wait=True)
+
+    async def _setup():
+        async with db_conn() as conn:
+            async with conn.cursor() as cur:
+                # the version lives in the users table comment (NULL if the table does not exist yet)
+                current = await fetch_scalar(cur, "SELECT obj_description(to_regclass('public.users'), 'pg_class')")
+                if current == f"schema {SCHEMA_VERSION}":
+                    return
+
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id BIGINT PRIMARY KEY,
                     username TEXT,
@@ -125,7 +244,7 @@ async def init_db(app: Application):
                 );
                 """)
 
-                cur.execute("""
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS task_catalog (
                     id BIGSERIAL PRIMARY KEY,
                     emoji TEXT NOT NULL,
@@ -138,7 +257,7 @@ async def init_db(app: Application):
                 );
                 """)
 
-                cur.execute("""
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS campaigns (
                     id BIGSERIAL PRIMARY KEY,
                     name TEXT NOT NULL,
@@ -152,7 +271,7 @@ async def init_db(app: Application):
                 );
                 """)
 
-                cur.execute("""
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS daily_tasks (
                     id BIGSERIAL PRIMARY KEY,
                     day DATE NOT NULL,
@@ -163,13 +282,36 @@ async def init_db(app: Application):
                     emoji TEXT NOT NULL,
                     title TEXT NOT NULL,
                     type TEXT NOT NULL,          -- checkin | quiz | link | campaign_link
-                    payload TEXT,                -- quiz: "q=...;a=..." (o solo "answer=...")
+                    payload TEXT,                -- legacy quiz: "q=...;answer=..." (o solo "answer=...")
                     link_url TEXT,
+                    quiz_question TEXT,
+                    quiz_answer TEXT,
+                    quiz_answer_casefold TEXT,   -- str.casefold() of quiz_answer, set on insert
                     UNIQUE(day, idx)
                 );
                 """)
 
-                cur.execute("""
+                # quiz columns for databases created before they existed
+                await cur.execute("ALTER TABLE daily_tasks ADD COLUMN IF NOT EXISTS quiz_question TEXT;")
+                await cur.execute("ALTER TABLE daily_tasks ADD COLUMN IF NOT EXISTS quiz_answer TEXT;")
+                await cur.execute("ALTER TABLE daily_tasks ADD COLUMN IF NOT EXISTS quiz_answer_casefold TEXT;")
+                await cur.execute("ALTER TABLE daily_tasks DROP COLUMN IF EXISTS quiz_answer_lower;")
+                await cur.execute("""
+                UPDATE daily_tasks
+                SET quiz_question = substring(payload from '^q=(.*);answer='),
+                    quiz_answer = COALESCE(substring(payload from ';answer=(.*)$'),
+                                           substring(payload from '^answer=(.*)$'))
+                WHERE type='quiz' AND quiz_answer IS NULL AND payload IS NOT NULL;
+                """)
+                # casefold in Python, like create_daily_tasks: SQL lower() differs (e.g. "ß"),
+                # and rows an older version filled with lower() get corrected here
+                await cur.execute("SELECT id, quiz_answer, quiz_answer_casefold FROM daily_tasks WHERE quiz_answer IS NOT NULL")
+                fixes = [(r["quiz_answer"].casefold(), r["id"]) for r in await cur.fetchall()
+                         if r["quiz_answer_casefold"] != r["quiz_answer"].casefold()]
+                if fixes:
+                    await cur.executemany("UPDATE daily_tasks SET quiz_answer_casefold=%s WHERE id=%s", fixes)
+
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS task_completions (
                     user_id BIGINT NOT NULL REFERENCES users(user_id),
                     task_id BIGINT NOT NULL REFERENCES daily_tasks(id),
@@ -178,7 +320,7 @@ async def init_db(app: Application):
                 );
                 """)
 
-                cur.execute("""
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS campaign_payouts (
                     campaign_id BIGINT NOT NULL REFERENCES campaigns(id),
                     user_id BIGINT NOT NULL REFERENCES users(user_id),
@@ -188,7 +330,7 @@ async def init_db(app: Application):
                 );
                 """)
 
-                cur.execute("""
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS withdrawals (
                     id BIGSERIAL PRIMARY KEY,
                     user_id BIGINT NOT NULL REFERENCES users(user_id),
@@ -201,7 +343,7 @@ async def init_db(app: Application):
                 );
                 """)
 
-                cur.execute("""
+                await cur.execute("""
                 CREATE TABLE IF NOT EXISTS activity_log (
                     id BIGSERIAL PRIMARY KEY,
                     user_id BIGINT NOT NULL REFERENCES users(user_id),
@@ -213,186 +355,343 @@ async def init_db(app: Application):
                 """)
 
                 # Helpful indexes (safe even if already exist)
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_daily_tasks_day ON daily_tasks(day);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_task_completions_user ON task_completions(user_id);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_activity_log_user ON activity_log(user_id);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_user ON withdrawals(user_id);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals(status);")
-            conn.commit()
+                # UNIQUE(day, idx) and the (user_id, task_id) primary key already lead with these columns
+                await cur.execute("DROP INDEX IF EXISTS idx_daily_tasks_day;")
+                await cur.execute("DROP INDEX IF EXISTS idx_task_completions_user;")
+                # get_active_campaign: newest active campaign
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_active ON campaigns(created_at DESC) WHERE is_active;")
+                # historial reads the latest rows per user: seek on (user_id, ts DESC, id DESC).
+                # ts, not id alone: batched /start rows get their id after rows logged later
+                await cur.execute("DROP INDEX IF EXISTS idx_activity_log_user;")
+                await cur.execute("DROP INDEX IF EXISTS idx_activity_log_user_id;")
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_activity_log_user_ts ON activity_log(user_id, ts DESC, id DESC);")
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_user ON withdrawals(user_id);")
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals(status);")
+
+                # task completion + day streak (used by confirm_task below)
+                await cur.execute("""
+                CREATE OR REPLACE FUNCTION complete_and_apply_streak(
+                    p_uid BIGINT, p_tid BIGINT, p_day DATE, p_log_title TEXT, p_step INT, p_max INT,
+                    OUT inserted BOOLEAN, OUT streaked BOOLEAN, OUT streak INT, OUT lvl INT, OUT prev_level INT
+                ) LANGUAGE plpgsql AS $$
+                DECLARE
+                    v_last DATE;
+                    v_total INT;
+                    v_done INT;
+                BEGIN
+                    INSERT INTO task_completions (user_id, task_id) VALUES (p_uid, p_tid)
+                    ON CONFLICT DO NOTHING;
+                    inserted := FOUND;
+                    streaked := FALSE;
+                    -- nothing new completed: the day's progress (and streak) can't have changed
+                    IF NOT inserted THEN
+                        RETURN;
+                    END IF;
+                    INSERT INTO activity_log (user_id, kind, title, meta) VALUES (p_uid, 'task', p_log_title, '');
+
+                    -- row lock: parallel completions of the last task can't both bump the streak
+                    SELECT u.last_completed_date, u.streak_days, u.level INTO v_last, streak, prev_level
+                    FROM users u WHERE u.user_id = p_uid FOR UPDATE;
+                    lvl := prev_level;
+                    IF v_last IS NOT DISTINCT FROM p_day THEN
+                        RETURN;
+                    END IF;
+
+                    SELECT COUNT(*), COUNT(c.task_id) INTO v_total, v_done
+                    FROM daily_tasks t
+                    LEFT JOIN task_completions c ON c.task_id = t.id AND c.user_id = p_uid
+                    WHERE t.day = p_day;
+
+                    IF v_total = 0 OR v_done < v_total THEN
+                        RETURN;
+                    END IF;
+
+                    streak := CASE WHEN v_last = p_day - 1 THEN streak + 1 ELSE 1 END;
+                    lvl := LEAST(GREATEST(1 + streak / p_step, 1), p_max);
+                    streaked := TRUE;
+
+                    UPDATE users SET last_completed_date = p_day, streak_days = streak, level = lvl
+                    WHERE user_id = p_uid;
+
+                    INSERT INTO activity_log (user_id, kind, title, meta)
+                    VALUES (p_uid, 'streak', '🔥 Racha: ' || streak || ' días', '');
+                    IF lvl <> prev_level THEN
+                        INSERT INTO activity_log (user_id, kind, title, meta)
+                        VALUES (p_uid, 'level', '🏅 Subió a nivel ' || lvl, '');
+                    END IF;
+                END;
+                $$;
+                """)
+
+                # campaign payout; the campaign row lock keeps parallel completions from overspending
+                await cur.execute("""
+                CREATE OR REPLACE FUNCTION pay_campaign(p_cid BIGINT, p_uid BIGINT, p_level INT)
+                RETURNS INT LANGUAGE plpgsql AS $$
+                DECLARE
+                    c campaigns%ROWTYPE;
+                    v_budget INT;
+                    v_needed INT;
+                    v_payout INT;
+                BEGIN
+                    SELECT * INTO c FROM campaigns WHERE id = p_cid FOR UPDATE;
+                    IF NOT FOUND OR NOT c.is_active THEN
+                        RETURN 0;
+                    END IF;
+
+                    v_budget := GREATEST(0, c.budget_usd_cents - c.spent_usd_cents);
+                    v_needed := GREATEST(0, c.goal_completions - c.completed_count);
+                    IF v_budget <= 0 OR v_needed <= 0 THEN
+                        UPDATE campaigns SET is_active = FALSE WHERE id = p_cid;
+                        RETURN 0;
+                    END IF;
+
+                    -- base share + level bonus (max 3), leaving at least 1 cent per remaining completion
+                    v_payout := GREATEST(1, LEAST(
+                        GREATEST(1, v_budget / v_needed) + GREATEST(0, LEAST(p_level - 1, 3)),
+                        v_budget - (v_needed - 1)
+                    ));
+
+                    -- the primary key is the double-pay gate: a concurrent or repeated payout inserts nothing
+                    INSERT INTO campaign_payouts (campaign_id, user_id, paid_usd_cents) VALUES (p_cid, p_uid, v_payout)
+                    ON CONFLICT (campaign_id, user_id) DO NOTHING;
+                    IF NOT FOUND THEN
+                        RETURN 0;
+                    END IF;
+
+                    UPDATE users SET balance_usd_cents = balance_usd_cents + v_payout WHERE user_id = p_uid;
+                    UPDATE campaigns
+                    SET completed_count = completed_count + 1,
+                        spent_usd_cents = spent_usd_cents + v_payout,
+                        is_active = completed_count + 1 < goal_completions
+                                    AND spent_usd_cents + v_payout < budget_usd_cents
+                    WHERE id = p_cid;
+
+                    INSERT INTO activity_log (user_id, kind, title, meta)
+                    VALUES (p_uid, 'earn', '💵 Ganó $' || to_char(v_payout / 100.0, 'FM999999990.00'), 'campaign=' || p_cid);
+                    RETURN v_payout;
+                END;
+                $$;
+                """)
+
+                # everything a task confirmation does, in one call
+                await cur.execute("""
+                CREATE OR REPLACE FUNCTION confirm_task(
+                    p_uid BIGINT, p_tid BIGINT, p_day DATE, p_log_title TEXT, p_step INT, p_max INT,
+                    OUT inserted BOOLEAN, OUT paid INT, OUT streaked BOOLEAN, OUT streak INT, OUT lvl INT
+                ) LANGUAGE plpgsql AS $$
+                DECLARE
+                    v_prev_level INT;
+                    v_cid BIGINT;
+                BEGIN
+                    SELECT s.inserted, s.streaked, s.streak, s.lvl, s.prev_level
+                    INTO inserted, streaked, streak, lvl, v_prev_level
+                    FROM complete_and_apply_streak(p_uid, p_tid, p_day, p_log_title, p_step, p_max) s;
+
+                    paid := 0;
+                    IF inserted THEN
+                        SELECT t.campaign_id INTO v_cid FROM daily_tasks t WHERE t.id = p_tid AND t.type = 'campaign_link';
+                        IF v_cid IS NOT NULL THEN
+                            -- bonus uses the level from before this completion
+                            paid := pay_campaign(v_cid, p_uid, v_prev_level);
+                        END IF;
+                    END IF;
+                END;
+                $$;
+                """)
 
-    await run_db(_setup)
+                await cur.execute(f"COMMENT ON TABLE users IS 'schema {SCHEMA_VERSION}'")
+
+    await _setup()
+
+    global _ACTIVITY_WRITER, _DAILY_TASKS_WARMER
+    if _ACTIVITY_WRITER is None or _ACTIVITY_WRITER.done():
+        _ACTIVITY_WRITER = asyncio.create_task(_activity_writer())
+    if _DAILY_TASKS_WARMER is None or _DAILY_TASKS_WARMER.done():
+        _DAILY_TASKS_WARMER = asyncio.create_task(_daily_tasks_warmer())
+
+async def close_db(app: Application):
+    if _DAILY_TASKS_WARMER:
+        _DAILY_TASKS_WARMER.cancel()
+        with suppress(asyncio.CancelledError):
+            await _DAILY_TASKS_WARMER
+    # flush queued activity rows before the pool goes away
+    if _ACTIVITY_WRITER:
+        _ACTIVITY_QUEUE.put_nowait(None)
+        await _ACTIVITY_WRITER
+    await POOL.close()
 
 # ======================
 # DB OPS
 # ======================
-def log_activity(cur, user_id: int, kind: str, title: str, meta: str = ""):
+async def log_activity(cur, user_id: int, kind: str, title: str, meta: str = ""):
     # NO commit here: keep it transaction-friendly
-    cur.execute(
+    await cur.execute(
         "INSERT INTO activity_log (user_id, kind, title, meta) VALUES (%s,%s,%s,%s)",
         (user_id, kind, title, meta),
+        prepare=True,
     )
 
-def ensure_user(cur, user):
-    cur.execute("""
+# fire-and-forget activity rows (e.g. /start visits): queued on the request path,
+# written in batches by _activity_writer. Rows that belong to a money/task
+# transaction keep using log_activity inside that transaction.
+_ACTIVITY_QUEUE: asyncio.Queue = asyncio.Queue()
+_ACTIVITY_WRITER = None
+ACTIVITY_BATCH_MAX = 256
+
+def log_activity_later(user_id: int, kind: str, title: str, meta: str = ""):
+    _ACTIVITY_QUEUE.put_nowait((user_id, kind, title, meta, now_local()))
+
+async def _activity_writer():
+    # whatever piled up while the previous batch was being written goes out together
+    while True:
+        batch = [await _ACTIVITY_QUEUE.get()]
+        while len(batch) < ACTIVITY_BATCH_MAX and not _ACTIVITY_QUEUE.empty():
+            batch.append(_ACTIVITY_QUEUE.get_nowait())
+
+        stop = None in batch
+        rows = [r for r in batch if r is not None]
+        if rows:
+            try:
+                async with db_conn() as conn, conn.cursor() as cur:
+                    await cur.executemany(
+                        "INSERT INTO activity_log (user_id, kind, title, meta, ts) VALUES (%s,%s,%s,%s,%s)",
+                        rows,
+                    )
+            except Exception:
+                logging.exception("Dropped %d activity_log rows", len(rows))
+        if stop:
+            return
+
+async def ensure_user(cur, user, day: date):
+    """Upserts the Telegram user (active on day) and returns the fresh users row."""
+    await cur.execute("""
         INSERT INTO users (user_id, username, first_name, last_active_date)
         VALUES (%s, %s, %s, %s)
         ON CONFLICT (user_id) DO UPDATE SET
             username = EXCLUDED.username,
             first_name = EXCLUDED.first_name,
             last_active_date = EXCLUDED.last_active_date
-    """, (user.id, user.username, user.first_name, today_local()))
-
-def get_user(cur, user_id: int):
-    cur.execute("SELECT * FROM users WHERE user_id=%s", (user_id,))
-    return cur.fetchone()
-
-def daily_tasks_exist(cur, day: date) -> bool:
-    cur.execute("SELECT 1 FROM daily_tasks WHERE day=%s LIMIT 1", (day,))
-    return cur.fetchone() is not None
-
-def list_daily_tasks(cur, user_id: int, day: date):
-    cur.execute("""
-        SELECT t.*,
-               EXISTS(
-                  SELECT 1 FROM task_completions c
-                  WHERE c.user_id=%s AND c.task_id=t.id
-               ) AS done
-        FROM daily_tasks t
-        WHERE t.day=%s
-        ORDER BY t.idx ASC
-    """, (user_id, day))
-    return cur.fetchall()
-
-def complete_task(cur, user_id: int, task_id: int) -> bool:
-    cur.execute("""
-        INSERT INTO task_completions (user_id, task_id)
-        VALUES (%s, %s)
-        ON CONFLICT DO NOTHING
-    """, (user_id, task_id))
-    return (cur.rowcount == 1)
-
-def all_tasks_done(cur, user_id: int, day: date) -> bool:
-    cur.execute("SELECT COUNT(*) AS total FROM daily_tasks WHERE day=%s", (day,))
-    total = cur.fetchone()["total"]
-    cur.execute("""
-        SELECT COUNT(*) AS done
-        FROM task_completions c
-        JOIN daily_tasks t ON t.id=c.task_id
-        WHERE c.user_id=%s AND t.day=%s
-    """, (user_id, day))
-    done = cur.fetchone()["done"]
-    return total > 0 and done == total
-
-def apply_streak_if_day_completed(cur, user_id: int, day: date):
-    if not all_tasks_done(cur, user_id, day):
-        u = get_user(cur, user_id)
-        return (False, u["streak_days"], u["level"])
-
-    cur.execute("SELECT last_completed_date, streak_days, level FROM users WHERE user_id=%s", (user_id,))
-    row = cur.fetchone()
-    last_done = row["last_completed_date"]
-    streak = row["streak_days"]
-    old_level = row["level"]
-
-    if last_done == day:
-        return (False, streak, old_level)
-
-    if last_done == (day - timedelta(days=1)):
-        streak += 1
-    else:
-        streak = 1
-
-    new_level = compute_level(streak)
+        RETURNING *
+    """, (user.id, user.username, user.first_name, day), prepare=True)
+    invalidate_user(user.id)
+    return await cur.fetchone()
 
-    cur.execute("""
-        UPDATE users
-        SET last_completed_date=%s, streak_days=%s, level=%s
-        WHERE user_id=%s
-    """, (day, streak, new_level, user_id))
-
-    log_activity(cur, user_id, "streak", f"🔥 Racha: {streak} días", "")
-    if new_level != old_level:
-        log_activity(cur, user_id, "level", f"🏅 Subió a nivel {new_level}", "")
-
-    return (True, streak, new_level)
+async def touch_user(user, user_data: dict, day: date):
+    """
+    ensure_user at most once per local day per user; the day is remembered in
+    PTB's user_data only after the upsert committed.
+    """
+    if user_data.get("ensured_day") == day:
+        return
+    async with db_conn() as conn, conn.cursor() as cur:
+        await ensure_user(cur, user, day)
+    user_data["ensured_day"] = day
+
+# user_id -> (expires_at, users row); every helper that writes a users row drops its entry
+_USER_CACHE: dict[int, tuple[float, dict]] = {}
+
+def invalidate_user(user_id: int):
+    _USER_CACHE.pop(user_id, None)
+
+async def get_user(user_id: int):
+    """Balance and streak/level columns for saldo/nivel; borrows a connection only on a miss."""
+    now = time.monotonic()
+    hit = _USER_CACHE.get(user_id)
+    if hit and hit[0] > now:
+        return hit[1]
+
+    async with db_autocommit() as conn, conn.cursor() as cur:
+        await cur.execute("""
+            SELECT balance_usd_cents, held_usd_cents, streak_days, level
+            FROM users WHERE user_id=%s
+        """, (user_id,), prepare=True)
+        row = await cur.fetchone()
+    if row:
+        if len(_USER_CACHE) >= 10_000:
+            for k in [k for k, v in _USER_CACHE.items() if v[0] <= now]:
+                del _USER_CACHE[k]
+        _USER_CACHE[user_id] = (now + USER_CACHE_TTL_S, row)
+    return row
+
+# compact record for the rendered task list (field order matches the task SELECTs)
+Task = namedtuple("Task", "id idx emoji title type link_url done")
+
+async def load_tasks_view(cur, user_id: int, day: date):
+    """User streak/level plus the day's tasks (with done flag), in one round trip."""
+    await cur.execute("""
+        WITH u AS (
+            SELECT streak_days, level FROM users WHERE user_id=%(uid)s
+        ), t AS (
+            SELECT t.id, t.idx, t.emoji, t.title, t.type, t.link_url,
+                   EXISTS(
+                      SELECT 1 FROM task_completions c
+                      WHERE c.user_id=%(uid)s AND c.task_id=t.id
+                   ) AS done
+            FROM daily_tasks t
+            WHERE t.day=%(day)s
+        )
+        SELECT (SELECT row_to_json(u) FROM u) AS user_json,
+               (SELECT json_agg(json_build_array(id, idx, emoji, title, type, link_url, done) ORDER BY idx)
+                FROM t) AS tasks_json
+    """, {"uid": user_id, "day": day}, prepare=True)
+    row = await cur.fetchone()
+    return row["user_json"], [Task._make(r) for r in row["tasks_json"] or ()]
+
+# today's daily_tasks rows by id; rows never change once generated, so only the day evicts
+_DAILY_TASK_CACHE: dict[int, dict] = {}
+_DAILY_TASK_CACHE_DAY = None
+
+async def touch_user_and_get_task(user, user_data: dict, day: date, task_id: int):
+    """
+    touch_user plus the daily_tasks row by id (served from memory for today's tasks).
+    Borrows a single pooled connection, and only when either one misses memory.
+    """
+    global _DAILY_TASK_CACHE_DAY
+    if _DAILY_TASK_CACHE_DAY != day:
+        _DAILY_TASK_CACHE.clear()
+        _DAILY_TASK_CACHE_DAY = day
+
+    ensure = user_data.get("ensured_day") != day
+    t = _DAILY_TASK_CACHE.get(task_id)
+    if ensure or t is None:
+        async with db_conn() as conn, conn.cursor() as cur:
+            if ensure:
+                await ensure_user(cur, user, day)
+            if t is None:
+                await cur.execute("SELECT * FROM daily_tasks WHERE id=%s", (task_id,), prepare=True)
+                t = await cur.fetchone()
+        if ensure:
+            user_data["ensured_day"] = day
+        if t and t["day"] == day:
+            _DAILY_TASK_CACHE[task_id] = t
+    return t
+
+async def confirm_task(cur, user_id: int, task_id: int, title: str, day: date):
+    """
+    Completion, campaign payout and day streak, all server-side in one call.
+    Returns (inserted, paid_cents, streaked, streak, level).
+    """
+    await cur.execute(
+        "SELECT * FROM confirm_task(%s,%s,%s,%s,%s,%s)",
+        (user_id, task_id, day, f"✅ Tarea confirmada: {title}", LEVEL_STEP_DAYS, MAX_LEVEL),
+        prepare=True,
+    )
+    r = await cur.fetchone()
+    if r["inserted"]:
+        invalidate_user(user_id)
+    return r["inserted"], r["paid"], r["streaked"], r["streak"], r["lvl"]
 
 # ======================
-# CAMPAIGNS PAYOUT (safe)
+# CAMPAIGNS
 # ======================
-def try_pay_campaign_locked(cur, campaign_id: int, user_id: int, user_level: int) -> int:
-    """
-    Atomic payout with row locks:
-    - locks campaign row so parallel completions don't overspend/overcount
-    """
-    # already paid?
-    cur.execute("SELECT 1 FROM campaign_payouts WHERE campaign_id=%s AND user_id=%s", (campaign_id, user_id))
-    if cur.fetchone():
-        return 0
-
-    # lock campaign
-    cur.execute("""
-        SELECT *
-        FROM campaigns
-        WHERE id=%s
-        FOR UPDATE
-    """, (campaign_id,))
-    c = cur.fetchone()
-    if not c or not c["is_active"]:
-        return 0
-
-    remaining_budget = max(0, c["budget_usd_cents"] - c["spent_usd_cents"])
-    remaining_needed = max(0, c["goal_completions"] - c["completed_count"])
-    if remaining_budget <= 0 or remaining_needed <= 0:
-        # close it if needed
-        cur.execute("UPDATE campaigns SET is_active=FALSE WHERE id=%s", (campaign_id,))
-        return 0
-
-    base = max(1, remaining_budget // remaining_needed)
-    bonus = max(0, min(user_level - 1, 3))
-    desired = base + bonus
-
-    # ensure we can still pay at least 1 for each remaining completion
-    max_allowed = remaining_budget - (remaining_needed - 1) * 1
-    payout = max(1, min(desired, max_allowed))
-    if payout <= 0:
-        cur.execute("UPDATE campaigns SET is_active=FALSE WHERE id=%s", (campaign_id,))
-        return 0
-
-    cur.execute("""
-        INSERT INTO campaign_payouts (campaign_id, user_id, paid_usd_cents)
-        VALUES (%s, %s, %s)
-    """, (campaign_id, user_id, payout))
-
-    cur.execute("""
-        UPDATE users
-        SET balance_usd_cents = balance_usd_cents + %s
-        WHERE user_id=%s
-    """, (payout, user_id))
-
-    cur.execute("""
-        UPDATE campaigns
-        SET completed_count = completed_count + 1,
-            spent_usd_cents = spent_usd_cents + %s
-        WHERE id=%s
-    """, (payout, campaign_id))
-
-    # re-read to decide closing
-    cur.execute("SELECT completed_count, goal_completions, spent_usd_cents, budget_usd_cents FROM campaigns WHERE id=%s", (campaign_id,))
-    c2 = cur.fetchone()
-    if c2["completed_count"] >= c2["goal_completions"] or c2["spent_usd_cents"] >= c2["budget_usd_cents"]:
-        cur.execute("UPDATE campaigns SET is_active=FALSE WHERE id=%s", (campaign_id,))
-
-    log_activity(cur, user_id, "earn", f"💵 Ganó {format_usd_from_cents(payout)}", f"campaign={campaign_id}")
-    return payout
-
-def get_active_campaign(cur):
-    cur.execute("""
-        SELECT * FROM campaigns
+async def get_active_campaign(cur):
+    await cur.execute("""
+        SELECT id, name, link_url FROM campaigns
         WHERE is_active=TRUE
         ORDER BY created_at DESC
         LIMIT 1
     """)
-    return cur.fetchone()
+    return await cur.fetchone()
 
 # ======================
 # DAILY TASK GENERATION
@@ -414,15 +713,21 @@ def _parse_quiz_content(raw: str, fallback_title: str):
         a = raw.strip()
     return q, a
 
-def create_daily_tasks(cur, day: date):
-    campaign = get_active_campaign(cur)
+async def create_daily_tasks(cur, day: date):
+    # serialize generation per day (held until the caller commits); later callers then see
+    # the committed rows and skip the work. Separate statements so the check runs after the lock.
+    await cur.execute("SELECT pg_advisory_xact_lock(hashtext('daily_tasks'), %s)", (day.toordinal(),))
+    if await fetch_scalar(cur, "SELECT EXISTS(SELECT 1 FROM daily_tasks WHERE day=%s)", (day,)):
+        return
+
+    campaign = await get_active_campaign(cur)
 
-    cur.execute("""
+    await cur.execute("""
         SELECT id, emoji, title, type, content, weight
         FROM task_catalog
         WHERE is_active=TRUE
     """)
-    catalog = cur.fetchall()
+    catalog = await cur.fetchall()
 
     rng = random.Random(day.toordinal())
     selected = []
@@ -438,11 +743,13 @@ def create_daily_tasks(cur, day: date):
         })
 
     remaining = max(0, TASKS_PER_DAY - len(selected))
-    pool = list(catalog)
 
-    for _ in range(min(remaining, len(pool))):
-        weights = [max(1, int(r["weight"])) for r in pool]
-        choice = rng.choices(pool, weights=weights, k=1)[0]
+    # weighted sampling without replacement in one pass (Efraimidis-Spirakis keys)
+    picks = heapq.nlargest(
+        remaining, catalog,
+        key=lambda r: rng.random() ** (1.0 / max(1, int(r["weight"]))),
+    )
+    for choice in picks:
         selected.append({
             "kind": "catalog",
             "catalog_id": choice["id"],
@@ -451,179 +758,245 @@ def create_daily_tasks(cur, day: date):
             "type": (choice["type"] or "").lower(),
             "content": (choice["content"] or "").strip(),
         })
-        pool = [x for x in pool if x["id"] != choice["id"]]
 
+    if not selected:
+        return
+
+    rows = []
     for idx, t in enumerate(selected, start=1):
-        payload = None
+        quiz_question = None
+        quiz_answer = None
+        quiz_answer_casefold = None
         link_url = None
-        ttype = (t["type"] or "").lower()
+        ttype = t["type"]
 
         if ttype == "quiz":
-            q, a = _parse_quiz_content(t.get("content", ""), t.get("title", ""))
-            payload = f"q={q.strip()};answer={a.strip().lower()}"
-        elif ttype in ("link", "campaign_link"):
+            quiz_question, quiz_answer = _parse_quiz_content(t.get("content", ""), t.get("title", ""))
+            quiz_answer_casefold = quiz_answer.casefold()
+        elif ttype in LINK_TYPES:
             link_url = t.get("content")
 
-        cur.execute("""
-            INSERT INTO daily_tasks (day, idx, kind, catalog_id, campaign_id, emoji, title, type, payload, link_url)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            ON CONFLICT (day, idx) DO NOTHING
-        """, (
-            day, idx, t["kind"],
+        rows.append((
+            idx, t["kind"],
             t.get("catalog_id"), t.get("campaign_id"),
             t["emoji"], t["title"], ttype,
-            payload, link_url
+            link_url, quiz_question, quiz_answer, quiz_answer_casefold,
         ))
 
+    # one idempotent statement with constant text: a no-op if the day was already generated
+    cols = [list(c) for c in zip(*rows)]
+    await cur.execute("""
+        INSERT INTO daily_tasks (day, idx, kind, catalog_id, campaign_id, emoji, title, type,
+                                 link_url, quiz_question, quiz_answer, quiz_answer_casefold)
+        SELECT %s::date, v.*
+        FROM unnest(%s::int[], %s::text[], %s::bigint[], %s::bigint[], %s::text[], %s::text[],
+                    %s::text[], %s::text[], %s::text[], %s::text[], %s::text[]) AS v
+        WHERE NOT EXISTS (SELECT 1 FROM daily_tasks WHERE day=%s)
+        ON CONFLICT (day, idx) DO NOTHING
+    """, [day, *cols, day])
+
+# generates each day's tasks just after local midnight so no user waits for it;
+# view_tasks still creates them lazily if this has not run (e.g. empty catalog)
+_DAILY_TASKS_WARMER = None
+
+async def _daily_tasks_warmer():
+    while True:
+        now = now_local()
+        midnight = datetime(now.year, now.month, now.day, tzinfo=TZ) + timedelta(days=1)
+        await asyncio.sleep((midnight - now).total_seconds() + 5)
+        try:
+            async with db_conn() as conn, conn.cursor() as cur:
+                await create_daily_tasks(cur, now_local().date())
+        except Exception:
+            logging.exception("daily task warm-up failed")
+
 # ======================
 # TASK UI
 # ======================
-def task_list_kb(tasks: list[dict]) -> InlineKeyboardMarkup:
+def task_list_kb(tasks: list[Task]) -> InlineKeyboardMarkup:
+    # every user sees the same daily tasks, so only the done flags vary: cache by content
+    return _task_list_kb(tuple(tasks))
+
+@lru_cache(maxsize=2048)
+def _task_list_kb(tasks: tuple[Task, ...]) -> InlineKeyboardMarkup:
     rows = []
-    for t in tasks:
-        label = f"{t['emoji']} {t['idx']}. {t['title']}"
-        if t["done"]:
+    for task_id, idx, emoji, title, ttype, link_url, done in tasks:
+        label = f"{emoji} {idx}. {title}"
+        if done:
             rows.append([InlineKeyboardButton(f"✅ {label}", callback_data="noop")])
             continue
 
-        ttype = (t["type"] or "").lower()
-        if ttype in ("link", "campaign_link"):
+        if ttype in LINK_TYPES:
             rows.append([
-                InlineKeyboardButton("🔗 Abrir", url=(t.get("link_url") or "")),
-                InlineKeyboardButton("✅ Confirmar", callback_data=f"task:confirm:{t['id']}")
+                InlineKeyboardButton("🔗 Abrir", url=(link_url or "")),
+                InlineKeyboardButton("✅ Confirmar", callback_data=f"task:confirm:{task_id}")
             ])
         elif ttype == "checkin":
-            rows.append([InlineKeyboardButton(f"✅ {label}", callback_data=f"task:do:{t['id']}")])
+            rows.append([InlineKeyboardButton(f"✅ {label}", callback_data=f"task:do:{task_id}")])
         elif ttype == "quiz":
-            rows.append([InlineKeyboardButton(f"🧠 {label}", callback_data=f"task:quiz:{t['id']}")])
+            rows.append([InlineKeyboardButton(f"🧠 {label}", callback_data=f"task:quiz:{task_id}")])
         else:
             rows.append([InlineKeyboardButton(label, callback_data="noop")])
 
     rows.append([InlineKeyboardButton("⬅️ Menú", callback_data="menu:home")])
     return InlineKeyboardMarkup(rows)
 
-def next_pending_task(cur, user_id: int, day: date, after_idx: int):
-    tasks = list_daily_tasks(cur, user_id, day)
-    pending = [t for t in tasks if not t["done"]]
-    if not pending:
-        return None
-    after = [t for t in pending if t["idx"] > after_idx]
-    return after[0] if after else pending[0]
+async def next_pending_task(cur, user_id: int, day: date, after_idx: int):
+    """First pending task after after_idx, wrapping around to the first pending one."""
+    await cur.execute("""
+        SELECT t.id, t.idx, t.emoji, t.title, t.type, t.link_url, FALSE AS done
+        FROM daily_tasks t
+        WHERE t.day=%s
+          AND NOT EXISTS (
+              SELECT 1 FROM task_completions c
+              WHERE c.user_id=%s AND c.task_id=t.id
+          )
+        ORDER BY t.idx <= %s, t.idx
+        LIMIT 1
+    """, (day, user_id, after_idx), prepare=True)
+    row = await cur.fetchone()
+    return Task._make(row.values()) if row else None
 
 # ======================
 # WITHDRAWALS
 # ======================
-def create_withdrawal(cur, user_id: int, amount_cents: int) -> int:
-    cur.execute("""
-        UPDATE users
-        SET balance_usd_cents = balance_usd_cents - %s,
-            held_usd_cents = held_usd_cents + %s
-        WHERE user_id=%s AND balance_usd_cents >= %s
-    """, (amount_cents, amount_cents, user_id, amount_cents))
-    if cur.rowcount != 1:
+async def create_withdrawal(cur, user_id: int, amount_cents: int) -> int:
+    # one statement: move balance to held, link the new withdrawal id, insert it and log it
+    wid = await fetch_scalar(cur, """
+        WITH u AS (
+            UPDATE users
+            SET balance_usd_cents = balance_usd_cents - %(amt)s,
+                held_usd_cents = held_usd_cents + %(amt)s,
+                pending_withdraw_id = nextval('withdrawals_id_seq')
+            WHERE user_id=%(uid)s AND balance_usd_cents >= %(amt)s
+            RETURNING user_id, pending_withdraw_id
+        ), w AS (
+            INSERT INTO withdrawals (id, user_id, amount_usd_cents, status)
+            SELECT pending_withdraw_id, user_id, %(amt)s, 'awaiting_details' FROM u
+        ), l AS (
+            INSERT INTO activity_log (user_id, kind, title, meta)
+            SELECT user_id, 'withdraw', %(title)s, 'id=' || pending_withdraw_id FROM u
+        )
+        SELECT pending_withdraw_id FROM u
+    """, {"uid": user_id, "amt": amount_cents,
+          "title": f"💸 Solicitó retiro {format_usd_from_cents(amount_cents)}"})
+    if wid is None:
         raise RuntimeError("Saldo insuficiente.")
-
-    cur.execute("""
-        INSERT INTO withdrawals (user_id, amount_usd_cents, status)
-        VALUES (%s,%s,'awaiting_details')
-        RETURNING id
-    """, (user_id, amount_cents))
-    wid = cur.fetchone()["id"]
-
-    cur.execute("UPDATE users SET pending_withdraw_id=%s WHERE user_id=%s", (wid, user_id))
-    log_activity(cur, user_id, "withdraw", f"💸 Solicitó retiro {format_usd_from_cents(amount_cents)}", f"id={wid}")
+    invalidate_user(user_id)
     return wid
 
-def attach_withdrawal_details(cur, user_id: int, details: str):
-    cur.execute("SELECT pending_withdraw_id FROM users WHERE user_id=%s", (user_id,))
-    row = cur.fetchone()
-    wid = row["pending_withdraw_id"] if row else None
+async def attach_withdrawal_details(cur, user_id: int, details: str):
+    # the user row lock serializes two detail messages sent at once; the second one sees NULL
+    wid = await fetch_scalar(
+        cur, "SELECT pending_withdraw_id FROM users WHERE user_id=%s FOR UPDATE", (user_id,)
+    )
     if not wid:
         return None
 
-    cur.execute("""
-        UPDATE withdrawals
-        SET payout_details=%s, status='pending', updated_at=NOW()
-        WHERE id=%s
-        RETURNING id, amount_usd_cents
-    """, (details, wid))
-    wrow = cur.fetchone()
-
-    cur.execute("UPDATE users SET pending_withdraw_id=NULL WHERE user_id=%s", (user_id,))
-    log_activity(cur, user_id, "withdraw", f"✅ Envió datos retiro #{wrow['id']}", "")
-    return wrow
-
-def admin_list_withdrawals(cur, limit: int = 10):
-    cur.execute("""
-        SELECT w.*, u.username, u.first_name
+    # the writes only depend on wid: pipelined, they cost one round trip.
+    # The link is cleared either way; the withdrawal only moves on (and is logged)
+    # if an admin has not rejected it meanwhile.
+    async with cur.connection.pipeline():
+        await cur.execute("UPDATE users SET pending_withdraw_id=NULL WHERE user_id=%s", (user_id,))
+        await cur.execute("""
+            WITH w AS (
+                UPDATE withdrawals
+                SET payout_details=%(details)s, status='pending', updated_at=NOW()
+                WHERE id=%(wid)s AND status='awaiting_details'
+                RETURNING id, user_id, amount_usd_cents
+            ), l AS (
+                INSERT INTO activity_log (user_id, kind, title, meta)
+                SELECT user_id, 'withdraw', %(title)s, '' FROM w
+            )
+            SELECT id, amount_usd_cents FROM w
+        """, {"details": details, "wid": wid, "title": f"✅ Envió datos retiro #{wid}"})
+    invalidate_user(user_id)
+    return await cur.fetchone()
+
+async def admin_list_withdrawals(cur, limit: int = 10):
+    # ts comes back already localized and formatted, like the historial lines.
+    # SKIP LOCKED hides withdrawals an admin is paying/rejecting right now; FOR SHARE so
+    # two admins listing at the same time don't hide rows from each other
+    await cur.execute("""
+        SELECT w.id, w.user_id, w.amount_usd_cents, w.status,
+               to_char(w.created_at AT TIME ZONE %s, 'DD/MM HH24:MI') AS ts,
+               u.username, u.first_name
         FROM withdrawals w
         JOIN users u ON u.user_id = w.user_id
         WHERE w.status IN ('pending','awaiting_details')
         ORDER BY w.created_at ASC
         LIMIT %s
-    """, (limit,))
-    return cur.fetchall()
-
-def admin_mark_withdrawal_paid(cur, wid: int, admin_note: str = ""):
-    # lock withdrawal + user to keep balances consistent
-    cur.execute("SELECT * FROM withdrawals WHERE id=%s FOR UPDATE", (wid,))
-    w = cur.fetchone()
-    if not w:
+        FOR SHARE OF w SKIP LOCKED
+    """, (TZ.key, limit))
+    return await cur.fetchall()
+
+async def admin_mark_withdrawal_paid(cur, wid: int, admin_note: str = ""):
+    # lock user + withdrawal to keep balances consistent; a second admin on the same id
+    # waits here and then sees the new status. User first, like attach_withdrawal_details,
+    # so the two can't deadlock
+    await cur.execute(
+        "SELECT 1 FROM users WHERE user_id = (SELECT user_id FROM withdrawals WHERE id=%s) FOR UPDATE", (wid,)
+    )
+    if not await cur.fetchone():
         raise RuntimeError("Retiro no encontrado.")
+    await cur.execute(
+        "SELECT id, user_id, amount_usd_cents, status FROM withdrawals WHERE id=%s FOR UPDATE", (wid,)
+    )
+    w = await cur.fetchone()
     if w["status"] != "pending":
         raise RuntimeError(f"Estado inválido: {w['status']} (debe ser pending).")
 
-    cur.execute("SELECT * FROM users WHERE user_id=%s FOR UPDATE", (w["user_id"],))
-    u = cur.fetchone()
-    if not u:
-        raise RuntimeError("Usuario no encontrado.")
-
     amt = int(w["amount_usd_cents"])
-    # when paying: release held
-    cur.execute("""
-        UPDATE users
-        SET held_usd_cents = GREATEST(0, held_usd_cents - %s)
-        WHERE user_id=%s
-    """, (amt, w["user_id"]))
-
-    cur.execute("""
-        UPDATE withdrawals
-        SET status='paid', admin_note=%s, updated_at=NOW()
-        WHERE id=%s
-    """, (admin_note, wid))
-
-    log_activity(cur, w["user_id"], "withdraw", f"✅ Retiro #{wid} pagado", "")
+    async with cur.connection.pipeline():
+        # when paying: release held
+        await cur.execute("""
+            UPDATE users
+            SET held_usd_cents = GREATEST(0, held_usd_cents - %s)
+            WHERE user_id=%s
+        """, (amt, w["user_id"]))
+
+        await cur.execute("""
+            UPDATE withdrawals
+            SET status='paid', admin_note=%s, updated_at=NOW()
+            WHERE id=%s
+        """, (admin_note, wid))
+
+        await log_activity(cur, w["user_id"], "withdraw", f"✅ Retiro #{wid} pagado", "")
+    invalidate_user(w["user_id"])
     return w
 
-def admin_reject_withdrawal(cur, wid: int, admin_note: str = ""):
-    cur.execute("SELECT * FROM withdrawals WHERE id=%s FOR UPDATE", (wid,))
-    w = cur.fetchone()
-    if not w:
+async def admin_reject_withdrawal(cur, wid: int, admin_note: str = ""):
+    await cur.execute(
+        "SELECT 1 FROM users WHERE user_id = (SELECT user_id FROM withdrawals WHERE id=%s) FOR UPDATE", (wid,)
+    )
+    if not await cur.fetchone():
         raise RuntimeError("Retiro no encontrado.")
+    await cur.execute(
+        "SELECT id, user_id, amount_usd_cents, status FROM withdrawals WHERE id=%s FOR UPDATE", (wid,)
+    )
+    w = await cur.fetchone()
     if w["status"] not in ("pending", "awaiting_details"):
         raise RuntimeError(f"Estado inválido: {w['status']}")
 
-    cur.execute("SELECT * FROM users WHERE user_id=%s FOR UPDATE", (w["user_id"],))
-    u = cur.fetchone()
-    if not u:
-        raise RuntimeError("Usuario no encontrado.")
-
     amt = int(w["amount_usd_cents"])
-    # reject: return funds to balance, remove from held
-    cur.execute("""
-        UPDATE users
-        SET balance_usd_cents = balance_usd_cents + %s,
-            held_usd_cents = GREATEST(0, held_usd_cents - %s)
-        WHERE user_id=%s
-    """, (amt, amt, w["user_id"]))
-
-    cur.execute("""
-        UPDATE withdrawals
-        SET status='rejected', admin_note=%s, updated_at=NOW()
-        WHERE id=%s
-    """, (admin_note, wid))
-
-    log_activity(cur, w["user_id"], "withdraw", f"❌ Retiro #{wid} rechazado", admin_note or "")
+    async with cur.connection.pipeline():
+        # reject: return funds to balance, remove from held
+        await cur.execute("""
+            UPDATE users
+            SET balance_usd_cents = balance_usd_cents + %s,
+                held_usd_cents = GREATEST(0, held_usd_cents - %s),
+                pending_withdraw_id = NULLIF(pending_withdraw_id, %s)
+            WHERE user_id=%s
+        """, (amt, amt, wid, w["user_id"]))
+
+        await cur.execute("""
+            UPDATE withdrawals
+            SET status='rejected', admin_note=%s, updated_at=NOW()
+            WHERE id=%s
+        """, (admin_note, wid))
+
+        await log_activity(cur, w["user_id"], "withdraw", f"❌ Retiro #{wid} rechazado", admin_note or "")
+    invalidate_user(w["user_id"])
     return w
 
 # ======================
@@ -638,35 +1011,64 @@ WELCOME = (
     "👇 Elegí una opción:"
 )
 
-def help_text():
-    return (
-        "ℹ️ **Ayuda**\n\n"
-        "• **📅 Tareas:** Abrí y confirmá.\n"
-        "• Si completás el día → suma racha.\n"
-        f"• Cada **{LEVEL_STEP_DAYS} días** consecutivos subís de nivel.\n\n"
-        f"💸 Retiro mínimo: **{format_usd_from_cents(MIN_WITHDRAW_USD_CENTS)}**\n"
-        "Cuando retires, te voy a pedir: alias/CBU/banco/titular/DNI.\n\n"
-        "🧠 **Quiz:** ahora podés cargarlo como `pregunta||respuesta` en el catálogo."
-    )
+MIN_WITHDRAW_TEXT = format_usd_from_cents(MIN_WITHDRAW_USD_CENTS)
+
+HELP_TEXT = (
+    "ℹ️ **Ayuda**\n\n"
+    "• **📅 Tareas:** Abrí y confirmá.\n"
+    "• Si completás el día → suma racha.\n"
+    f"• Cada **{LEVEL_STEP_DAYS} días** consecutivos subís de nivel.\n\n"
+    f"💸 Retiro mínimo: **{MIN_WITHDRAW_TEXT}**\n"
+    "Cuando retires, te voy a pedir: alias/CBU/banco/titular/DNI.\n\n"
+    "🧠 **Quiz:** ahora podés cargarlo como `pregunta||respuesta` en el catálogo."
+)
+
+RETIRAR_TEXT = f"💸 Para retirar usá **/retirar**\n\nMínimo: **{MIN_WITHDRAW_TEXT}**"
+
+# /start reply: WELCOME plus the user's stats, in one template
+_START_FMT = (WELCOME + "\n\n🔥 **Racha:** {streak} | 🏅 **Nivel:** {level}/" + str(MAX_LEVEL)).format
+
+_SALDO_FMT = (
+    "💰 **Disponible:** {balance}\n"
+    "🔒 **Retenido:** {held}\n\n"
+    f"💸 Mínimo retiro: **{MIN_WITHDRAW_TEXT}**"
+).format
+
+_NIVEL_FMT = (
+    f"🏅 **Nivel:** {{level}} / {MAX_LEVEL}\n"
+    "🔥 **Racha:** {streak} días\n\n"
+    "🎯 Próximo objetivo: **{target}** días consecutivos."
+).format
 
 # ======================
 # VIEWS
 # ======================
+# (user_id, day) -> (expires_at, text, kb); dropped on every completion by that user
+_TASKS_VIEW_CACHE: dict[tuple[int, date], tuple[float, str, InlineKeyboardMarkup]] = {}
+
+def invalidate_tasks_view(user_id: int, day: date):
+    _TASKS_VIEW_CACHE.pop((user_id, day), None)
+
 async def view_tasks(user_id: int):
     day = today_local()
-
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            if not daily_tasks_exist(cur, day):
-                create_daily_tasks(cur, day)
-            user = get_user(cur, user_id)
-            tasks = list_daily_tasks(cur, user_id, day)
-            conn.commit()
+    key = (user_id, day)
+    now = time.monotonic()
+
+    hit = _TASKS_VIEW_CACHE.get(key)
+    if hit and hit[0] > now:
+        return hit[1], hit[2]
+
+    async def _work():
+        async with db_conn() as conn, conn.cursor() as cur:
+            user, tasks = await load_tasks_view(cur, user_id, day)
+            if not tasks:
+                await create_daily_tasks(cur, day)
+                user, tasks = await load_tasks_view(cur, user_id, day)
             return user, tasks
 
-    user, tasks = await run_db(_work)
+    user, tasks = await _work()
 
-    done = sum(1 for t in tasks if t["done"])
+    done = sum(1 for t in tasks if t.done)
     total = len(tasks)
 
     text = (
@@ -675,93 +1077,92 @@ async def view_tasks(user_id: int):
         f"✅ Completadas: **{done}/{total}**\n\n"
         "Abrí y confirmá 👇"
     )
-    return text, task_list_kb(tasks)
+    kb = task_list_kb(tasks)
+
+    if len(_TASKS_VIEW_CACHE) >= 4096:
+        for k in [k for k, v in _TASKS_VIEW_CACHE.items() if v[0] <= now]:
+            del _TASKS_VIEW_CACHE[k]
+    _TASKS_VIEW_CACHE[key] = (now + TASKS_VIEW_TTL_S, text, kb)
+    return text, kb
 
 async def view_saldo(user_id: int):
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            u = get_user(cur, user_id)
-            return u
-    u = await run_db(_work)
-    return (
-        f"💰 **Disponible:** {format_usd_from_cents(u['balance_usd_cents'])}\n"
-        f"🔒 **Retenido:** {format_usd_from_cents(u.get('held_usd_cents', 0))}\n\n"
-        f"💸 Mínimo retiro: **{format_usd_from_cents(MIN_WITHDRAW_USD_CENTS)}**"
+    u = await get_user(user_id)
+    return _SALDO_FMT(
+        balance=format_usd_from_cents(u["balance_usd_cents"]),
+        held=format_usd_from_cents(u.get("held_usd_cents", 0)),
     )
 
 async def view_nivel(user_id: int):
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            u = get_user(cur, user_id)
-            return u
-    u = await run_db(_work)
-    next_target = u["level"] * LEVEL_STEP_DAYS
-    return (
-        f"🏅 **Nivel:** {u['level']} / {MAX_LEVEL}\n"
-        f"🔥 **Racha:** {u['streak_days']} días\n\n"
-        f"🎯 Próximo objetivo: **{next_target}** días consecutivos."
-    )
+    u = await get_user(user_id)
+    return _NIVEL_FMT(level=u["level"], streak=u["streak_days"], target=u["level"] * LEVEL_STEP_DAYS)
 
 async def view_historial(user_id: int):
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            cur.execute("""
-                SELECT ts, title FROM activity_log
-                WHERE user_id=%s
-                ORDER BY id DESC
-                LIMIT 25
-            """, (user_id,))
-            return cur.fetchall()
-
-    rows = await run_db(_work)
-    if not rows:
+    async def _work():
+        async with db_autocommit() as conn, conn.cursor() as cur:
+            # Postgres localizes, formats, Markdown-escapes (like escape_markdown) and joins: one row back
+            return await fetch_scalar(cur, r"""
+                SELECT string_agg(
+                    format('• `%%s` — %%s', to_char(ts AT TIME ZONE %s, 'DD/MM HH24:MI'),
+                           regexp_replace(title, '([_*`[])', '\\\1', 'g')),
+                    E'\n' ORDER BY ts DESC, id DESC
+                )
+                FROM (
+                    -- by ts: queued /start rows carry their event time but get a later id
+                    SELECT id, ts, title
+                    FROM activity_log
+                    WHERE user_id=%s
+                    ORDER BY ts DESC, id DESC
+                    LIMIT 25
+                ) recent
+            """, (TZ.key, user_id), prepare=True)
+
+    body = await _work()
+    if not body:
         return "📜 Todavía no hay actividad registrada."
 
-    lines = ["📜 **Historial (últimos 25)**\n"]
-    for r in rows:
-        ts = r["ts"].astimezone(TZ).strftime("%d/%m %H:%M")
-        lines.append(f"• `{ts}` — {r['title']}")
-    return "\n".join(lines)
+    return "📜 **Historial (últimos 25)**\n\n" + body
 
 # ======================
 # ADMIN UI
 # ======================
+_ADMIN_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Crear tarea", callback_data="admin:add_task"),
+     InlineKeyboardButton("🎯 Crear campaña", callback_data="admin:add_campaign")],
+    [InlineKeyboardButton("⬅️ Menú", callback_data="menu:home")]
+])
+
 def admin_kb():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Crear tarea", callback_data="admin:add_task"),
-         InlineKeyboardButton("🎯 Crear campaña", callback_data="admin:add_campaign")],
-        [InlineKeyboardButton("⬅️ Menú", callback_data="menu:home")]
-    ])
+    return _ADMIN_KB
 
 # ======================
 # COMMANDS
 # ======================
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
+    day = today_local()
 
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            ensure_user(cur, u)
-            log_activity(cur, u.id, "user", "👋 /start", "")
-            if not daily_tasks_exist(cur, today_local()):
-                create_daily_tasks(cur, today_local())
-            user_row = get_user(cur, u.id)
-            conn.commit()
-            return user_row
+    async def _work():
+        async with db_conn() as conn, conn.cursor() as cur:
+            return await ensure_user(cur, u, day)
 
-    user_row = await run_db(_work)
+    user_row = await _work()
+    context.user_data["ensured_day"] = day
+    # queued only after the upsert committed: the row's user_id FK must resolve
+    log_activity_later(u.id, "user", "👋 /start")
 
     await update.message.reply_text(
-        WELCOME.format(name=(u.first_name or "")) +
-        f"\n\n🔥 **Racha:** {user_row['streak_days']} | 🏅 **Nivel:** {user_row['level']}/{MAX_LEVEL}",
+        _START_FMT(name=escape_markdown(u.first_name or ""), streak=user_row["streak_days"], level=user_row["level"]),
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=inline_menu(u.id)
     )
 
+_WHOAMI_FMT = "✅ Bot activo\nuser_id: {uid}\nadmin: {adm}".format
+
 async def cmd_whoami(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # pure in-memory reply: no DB access on this path
     u = update.effective_user
     await update.message.reply_text(
-        f"✅ Bot activo\nuser_id: {u.id}\nadmin: {is_admin(u.id)}",
+        _WHOAMI_FMT(uid=u.id, adm=is_admin(u.id)),
         reply_markup=inline_menu(u.id)
     )
 
@@ -772,29 +1173,25 @@ async def cmd_retirar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     u = update.effective_user
 
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            ensure_user(cur, u)
-            user_row = get_user(cur, u.id)
+    async def _work():
+        async with db_conn() as conn, conn.cursor() as cur:
+            user_row = await ensure_user(cur, u, today_local())
 
             if user_row["pending_withdraw_id"]:
-                conn.commit()
                 return ("pending", user_row["pending_withdraw_id"], user_row)
 
             if user_row["balance_usd_cents"] < MIN_WITHDRAW_USD_CENTS:
-                conn.commit()
                 return ("min", None, user_row)
 
-            wid = create_withdrawal(cur, u.id, user_row["balance_usd_cents"])
-            user_row2 = get_user(cur, u.id)
-            conn.commit()
-            return ("created", wid, user_row2)
+            wid = await create_withdrawal(cur, u.id, user_row["balance_usd_cents"])
+            # the "created" reply shows no balances: no need to re-read the user
+            return ("created", wid, None)
 
-    status, wid, user_row = await run_db(_work)
+    status, wid, user_row = await _work()
 
     if status == "min":
         await update.message.reply_text(
-            f"💸 Mínimo retiro: **{format_usd_from_cents(MIN_WITHDRAW_USD_CENTS)}**\n"
+            f"💸 Mínimo retiro: **{MIN_WITHDRAW_TEXT}**\n"
             f"Disponible: **{format_usd_from_cents(user_row['balance_usd_cents'])}**",
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=inline_menu(u.id)
@@ -821,31 +1218,36 @@ async def cmd_retirar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # -------- Admin commands (new) --------
+_WITHDRAWAL_LINE_FMT = (
+    "• **#{id}** — {amount} — `{status}`\n"
+    "  Usuario: `{user_id}` {who}\n"
+    "  Fecha: `{ts}`"
+).format
+
 async def cmd_withdrawals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if not is_admin(u.id):
         await update.message.reply_text("⛔ No autorizado.")
         return
 
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            rows = admin_list_withdrawals(cur, limit=10)
+    async def _work():
+        async with db_autocommit() as conn, conn.cursor() as cur:
+            rows = await admin_list_withdrawals(cur, limit=10)
             return rows
 
-    rows = await run_db(_work)
+    rows = await _work()
     if not rows:
         await update.message.reply_text("✅ No hay retiros pendientes.")
         return
 
     lines = ["🔔 **Retiros pendientes (hasta 10)**\n"]
     for w in rows:
-        ts = w["created_at"].astimezone(TZ).strftime("%d/%m %H:%M")
-        who = f"{w.get('first_name') or ''} (@{w.get('username') or '-'})".strip()
-        lines.append(
-            f"• **#{w['id']}** — {format_usd_from_cents(w['amount_usd_cents'])} — `{w['status']}`\n"
-            f"  Usuario: `{w['user_id']}` {who}\n"
-            f"  Fecha: `{ts}`"
-        )
+        # names are user-controlled: escape so a "_" can't break the Markdown reply
+        who = escape_markdown(f"{w['first_name'] or ''} (@{w['username'] or '-'})".strip())
+        lines.append(_WITHDRAWAL_LINE_FMT(
+            id=w["id"], amount=format_usd_from_cents(w["amount_usd_cents"]), status=w["status"],
+            user_id=w["user_id"], who=who, ts=w["ts"],
+        ))
     lines.append("\nUsá:\n• `/pay <id> [nota]`\n• `/reject <id> [motivo]`")
     await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
 
@@ -868,29 +1270,29 @@ async def cmd_pay(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     note = " ".join(args[1:]).strip()
 
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            w = admin_mark_withdrawal_paid(cur, wid, admin_note=note)
-            conn.commit()
+    async def _work():
+        async with db_conn() as conn, conn.cursor() as cur:
+            w = await admin_mark_withdrawal_paid(cur, wid, admin_note=note)
             return w
 
     try:
-        w = await run_db(_work)
+        w = await _work()
     except Exception as e:
         await update.message.reply_text(f"⚠️ {e}")
         return
 
-    # notify user
-    try:
-        await context.bot.send_message(
+    # notify user (best-effort) and ack the admin concurrently
+    results = await asyncio.gather(
+        update.message.reply_text(f"✅ Retiro #{wid} marcado como PAGADO."),
+        context.bot.send_message(
             chat_id=w["user_id"],
             text=f"✅ Tu retiro **#{w['id']}** fue marcado como **PAGADO**.\nMonto: **{format_usd_from_cents(w['amount_usd_cents'])}**",
             parse_mode=ParseMode.MARKDOWN
-        )
-    except Exception:
-        pass
-
-    await update.message.reply_text(f"✅ Retiro #{wid} marcado como PAGADO.")
+        ),
+        return_exceptions=True
+    )
+    if isinstance(results[0], BaseException):
+        raise results[0]
 
 async def cmd_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
@@ -911,244 +1313,220 @@ async def cmd_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     note = " ".join(args[1:]).strip()
 
-    def _work():
-        with db_conn() as conn, conn.cursor() as cur:
-            w = admin_reject_withdrawal(cur, wid, admin_note=note)
-            conn.commit()
+    async def _work():
+        async with db_conn() as conn, conn.cursor() as cur:
+            w = await admin_reject_withdrawal(cur, wid, admin_note=note)
             return w
 
     try:
-        w = await run_db(_work)
+        w = await _work()
     except Exception as e:
         await update.message.reply_text(f"⚠️ {e}")
         return
 
-    # notify user
-    try:
-        extra = f"\nMotivo: {note}" if note else ""
-        await context.bot.send_message(
+    # notify user (best-effort) and ack the admin concurrently
+    extra = f"\nMotivo: {escape_markdown(note)}" if note else ""
+    results = await asyncio.gather(
+        update.message.reply_text(f"✅ Retiro #{wid} rechazado y fondos devueltos."),
+        context.bot.send_message(
             chat_id=w["user_id"],
             text=(
                 f"❌ Tu retiro **#{w['id']}** fue **RECHAZADO**.\n"
                 f"El monto volvió a tu saldo disponible: **{format_usd_from_cents(w['amount_usd_cents'])}**{extra}"
             ),
             parse_mode=ParseMode.MARKDOWN
-        )
-    except Exception:
-        pass
-
-    await update.message.reply_text(f"✅ Retiro #{wid} rechazado y fondos devueltos.")
+        ),
+        return_exceptions=True
+    )
+    if isinstance(results[0], BaseException):
+        raise results[0]
 
 # ======================
 # CALLBACKS
 # ======================
-async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
-    u = q.from_user
-    data = q.data or ""
-
-    if data == "noop":
+# (chat_id, message_id) -> (text, markup) last sent by edit_text; bounded, oldest dropped first
+_LAST_EDIT: dict[tuple[int, int], tuple[str, InlineKeyboardMarkup | None]] = {}
+
+async def edit_text(q, text: str, reply_markup: InlineKeyboardMarkup | None = None):
+    """edit_message_text, skipped when the message already shows this text and keyboard."""
+    key = (q.message.chat_id, q.message.message_id)
+    shown = (text, reply_markup)
+    if _LAST_EDIT.get(key) == shown:
         return
+    await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+    if len(_LAST_EDIT) >= 4096:
+        del _LAST_EDIT[next(iter(_LAST_EDIT))]
+    _LAST_EDIT[key] = shown
 
-    if data == "menu:home":
-        await q.edit_message_text("📌 **Menú**", parse_mode=ParseMode.MARKDOWN, reply_markup=inline_menu(u.id))
-        return
+# client-side cache for answers to inert "noop" buttons (done/locked task rows)
+NOOP_ANSWER_CACHE_S = 3600
 
-    if data == "menu:tareas":
-        text, kb = await view_tasks(u.id)
-        await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
-        return
+async def _cb_noop(q, u, context):
+    return
 
-    if data == "menu:saldo":
-        await q.edit_message_text(await view_saldo(u.id), parse_mode=ParseMode.MARKDOWN, reply_markup=back_to_menu(u.id))
-        return
+async def _cb_home(q, u, context):
+    await edit_text(q, "📌 **Menú**", inline_menu(u.id))
 
-    if data == "menu:nivel":
-        await q.edit_message_text(await view_nivel(u.id), parse_mode=ParseMode.MARKDOWN, reply_markup=back_to_menu(u.id))
-        return
+async def _cb_tareas(q, u, context):
+    text, kb = await view_tasks(u.id)
+    await edit_text(q, text, kb)
 
-    if data == "menu:historial":
-        await q.edit_message_text(await view_historial(u.id), parse_mode=ParseMode.MARKDOWN, reply_markup=back_to_menu(u.id))
-        return
+async def _cb_saldo(q, u, context):
+    await edit_text(q, await view_saldo(u.id), back_to_menu(u.id))
 
-    if data == "menu:ayuda":
-        await q.edit_message_text(help_text(), parse_mode=ParseMode.MARKDOWN, reply_markup=back_to_menu(u.id))
-        return
+async def _cb_nivel(q, u, context):
+    await edit_text(q, await view_nivel(u.id), back_to_menu(u.id))
 
-    if data == "menu:retirar":
-        await q.edit_message_text(
-            f"💸 Para retirar usá **/retirar**\n\nMínimo: **{format_usd_from_cents(MIN_WITHDRAW_USD_CENTS)}**",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=back_to_menu(u.id)
-        )
+async def _cb_historial(q, u, context):
+    await edit_text(q, await view_historial(u.id), back_to_menu(u.id))
+
+async def _cb_ayuda(q, u, context):
+    await edit_text(q, HELP_TEXT, back_to_menu(u.id))
+
+async def _cb_retirar(q, u, context):
+    await edit_text(q, RETIRAR_TEXT, back_to_menu(u.id))
+
+async def _cb_admin_panel(q, u, context):
+    if not is_admin(u.id):
+        await q.answer("⛔ No autorizado", show_alert=True)
         return
+    await edit_text(
+        q,
+        "⚙️ **Admin**\n\nComandos:\n• /withdrawals\n• /pay <id>\n• /reject <id>",
+        admin_kb()
+    )
 
-    # ADMIN
-    if data == "admin:panel":
-        if not is_admin(u.id):
-            await q.answer("⛔ No autorizado", show_alert=True)
-            return
-        await q.edit_message_text(
-            "⚙️ **Admin**\n\nComandos:\n• /withdrawals\n• /pay <id>\n• /reject <id>",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=admin_kb()
-        )
+async def _cb_admin_add_task(q, u, context):
+    if not is_admin(u.id):
+        await q.answer("⛔ No autorizado", show_alert=True)
         return
+    context.user_data["admin_flow"] = {"type": "add_task"}
+    await edit_text(
+        q,
+        "➕ **Crear tarea**\n\nPegá así:\n"
+        "`emoji | titulo | tipo | contenido`\n\n"
+        "Tipos: `checkin`, `quiz`, `link`\n"
+        "Quiz recomendado:\n`🧠 | Pregunta del día | quiz | ¿Capital de Francia?||paris`\n"
+        "Link:\n`📌 | Visitar enlace | link | https://ejemplo.com`",
+        admin_kb()
+    )
 
-    if data == "admin:add_task":
-        if not is_admin(u.id):
-            await q.answer("⛔ No autorizado", show_alert=True)
-            return
-        context.user_data["admin_flow"] = {"type": "add_task"}
-        await q.edit_message_text(
-            "➕ **Crear tarea**\n\nPegá así:\n"
-            "`emoji | titulo | tipo | contenido`\n\n"
-            "Tipos: `checkin`, `quiz`, `link`\n"
-            "Quiz recomendado:\n`🧠 | Pregunta del día | quiz | ¿Capital de Francia?||paris`\n"
-            "Link:\n`📌 | Visitar enlace | link | https://ejemplo.com`",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=admin_kb()
-        )
+async def _cb_admin_add_campaign(q, u, context):
+    if not is_admin(u.id):
+        await q.answer("⛔ No autorizado", show_alert=True)
         return
+    context.user_data["admin_flow"] = {"type": "add_campaign"}
+    await edit_text(
+        q,
+        "🎯 **Crear campaña**\n\nPegá así:\n"
+        "`nombre | link | presupuesto_usd | objetivo`\n\n"
+        "Ej:\n`Campaña 1 | https://ejemplo.com | 10 | 200`",
+        admin_kb()
+    )
 
-    if data == "admin:add_campaign":
-        if not is_admin(u.id):
-            await q.answer("⛔ No autorizado", show_alert=True)
-            return
-        context.user_data["admin_flow"] = {"type": "add_campaign"}
-        await q.edit_message_text(
-            "🎯 **Crear campaña**\n\nPegá así:\n"
-            "`nombre | link | presupuesto_usd | objetivo`\n\n"
-            "Ej:\n`Campaña 1 | https://ejemplo.com | 10 | 200`",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=admin_kb()
-        )
+# exact callback_data -> handler(q, u, context); "task:*" is parsed in on_callback
+CALLBACK_ROUTES = {
+    "noop": _cb_noop,
+    "menu:home": _cb_home,
+    "menu:tareas": _cb_tareas,
+    "menu:saldo": _cb_saldo,
+    "menu:nivel": _cb_nivel,
+    "menu:historial": _cb_historial,
+    "menu:ayuda": _cb_ayuda,
+    "menu:retirar": _cb_retirar,
+    "admin:panel": _cb_admin_panel,
+    "admin:add_task": _cb_admin_add_task,
+    "admin:add_campaign": _cb_admin_add_campaign,
+}
+
+async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    data = q.data or ""
+    # "noop" buttons never change anything: let the client cache the answer and stop sending them
+    await q.answer(cache_time=NOOP_ANSWER_CACHE_S if data == "noop" else None)
+    u = q.from_user
+
+    handler = CALLBACK_ROUTES.get(data)
+    if handler:
+        await handler(q, u, context)
         return
 
     # TASK ACTIONS
     if data.startswith("task:"):
         parts = data.split(":")
         action = parts[1]
+        # one local day for the whole action: the task check and the completion can't straddle midnight
+        day = today_local()
 
         if action == "next":
             after_idx = int(parts[2])
-            day = today_local()
 
-            def _work():
-                with db_conn() as conn, conn.cursor() as cur:
-                    ensure_user(cur, u)
-                    nxt = next_pending_task(cur, u.id, day, after_idx)
-                    conn.commit()
-                    return nxt
+            await touch_user(u, context.user_data, day)
 
-            nxt = await run_db(_work)
+            async def _work():
+                async with db_autocommit() as conn, conn.cursor() as cur:
+                    return await next_pending_task(cur, u.id, day, after_idx)
+
+            nxt = await _work()
             if not nxt:
-                await q.edit_message_text(
+                await edit_text(
+                    q,
                     "🎉 **Listo!** Completaste todas las tareas de hoy.",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=inline_menu(u.id)
+                    inline_menu(u.id)
                 )
                 return
 
-            ttype = (nxt["type"] or "").lower()
-            if ttype in ("link", "campaign_link"):
-                kb = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔗 Abrir", url=(nxt.get("link_url") or "")),
-                     InlineKeyboardButton("✅ Confirmar", callback_data=f"task:confirm:{nxt['id']}")],
-                    [InlineKeyboardButton("📅 Ver tareas", callback_data="menu:tareas"),
-                     InlineKeyboardButton("🏠 Menú", callback_data="menu:home")]
-                ])
-            elif ttype == "checkin":
-                kb = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✅ Completar", callback_data=f"task:do:{nxt['id']}")],
-                    [InlineKeyboardButton("📅 Ver tareas", callback_data="menu:tareas"),
-                     InlineKeyboardButton("🏠 Menú", callback_data="menu:home")]
-                ])
-            elif ttype == "quiz":
-                kb = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🧠 Responder", callback_data=f"task:quiz:{nxt['id']}")],
-                    [InlineKeyboardButton("📅 Ver tareas", callback_data="menu:tareas"),
-                     InlineKeyboardButton("🏠 Menú", callback_data="menu:home")]
-                ])
-            else:
-                kb = InlineKeyboardMarkup([[InlineKeyboardButton("📅 Ver tareas", callback_data="menu:tareas")]])
-
-            await q.edit_message_text(
-                f"➡️ **Siguiente tarea**\n\n{nxt['emoji']} **{nxt['idx']}. {nxt['title']}**",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=kb
+            kb = next_task_kb(nxt.type, nxt.id, nxt.link_url)
+
+            await edit_text(
+                q,
+                f"➡️ **Siguiente tarea**\n\n{nxt.emoji} **{nxt.idx}. {escape_markdown(nxt.title)}**",
+                kb
             )
             return
 
         # actions with task_id
         task_id = int(parts[2])
-        day = today_local()
-
-        def _load():
-            with db_conn() as conn, conn.cursor() as cur:
-                ensure_user(cur, u)
-                cur.execute("SELECT * FROM daily_tasks WHERE id=%s", (task_id,))
-                t = cur.fetchone()
-                user_row = get_user(cur, u.id)
-                conn.commit()
-                return t, user_row
 
-        t, user_row = await run_db(_load)
+        t = await touch_user_and_get_task(u, context.user_data, day, task_id)
         if not t or t["day"] != day:
             await q.answer("⚠️ Esa tarea no es de hoy.", show_alert=True)
             return
 
-        ttype = (t["type"] or "").lower()
+        ttype = t["type"]
 
         if action == "do" and ttype == "checkin":
-            def _do():
-                with db_conn() as conn, conn.cursor() as cur:
-                    inserted = complete_task(cur, u.id, task_id)
-                    if inserted:
-                        log_activity(cur, u.id, "task", f"✅ Tarea confirmada: {t['title']}", "")
-                    streaked, streak, lvl = apply_streak_if_day_completed(cur, u.id, day)
-                    conn.commit()
+            async def _do():
+                async with db_autocommit() as conn, conn.cursor() as cur:
+                    inserted, _, streaked, streak, lvl = await confirm_task(cur, u.id, task_id, t["title"], day)
                     return inserted, streaked, streak, lvl
 
-            inserted, streaked, streak, lvl = await run_db(_do)
+            inserted, streaked, streak, lvl = await _do()
+            invalidate_tasks_view(u.id, day)
             msg = "✅ **Tarea confirmada.**" if inserted else "⚠️ Ya estaba confirmada."
             if streaked:
                 msg += f"\n🔥 Racha: **{streak}** | 🏅 Nivel: **{lvl}**"
-            await q.edit_message_text(msg, parse_mode=ParseMode.MARKDOWN, reply_markup=next_after_task_kb(t["idx"]))
+            await edit_text(q, msg, next_after_task_kb(t["idx"]))
             return
 
         if action == "quiz" and ttype == "quiz":
             # show question if present
-            payload = t.get("payload") or ""
-            question = ""
-            if payload.startswith("q=") and ";answer=" in payload:
-                question = payload.split("q=", 1)[1].split(";answer=", 1)[0].strip()
+            question = escape_markdown((t.get("quiz_question") or "").strip())
             context.user_data["pending_quiz"] = {"task_id": task_id}
-            await q.edit_message_text(
-                f"🧠 **{t['title']}**\n\n{question or 'Escribí tu respuesta ahora.'}",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=back_to_menu(u.id)
+            await edit_text(
+                q,
+                f"🧠 **{escape_markdown(t['title'])}**\n\n{question or 'Escribí tu respuesta ahora.'}",
+                back_to_menu(u.id)
             )
             return
 
-        if action == "confirm" and ttype in ("link", "campaign_link"):
-            def _confirm():
-                with db_conn() as conn, conn.cursor() as cur:
-                    inserted = complete_task(cur, u.id, task_id)
-                    paid = 0
+        if action == "confirm" and ttype in LINK_TYPES:
+            async def _confirm():
+                async with db_autocommit() as conn, conn.cursor() as cur:
+                    return await confirm_task(cur, u.id, task_id, t["title"], day)
 
-                    if inserted:
-                        log_activity(cur, u.id, "task", f"✅ Tarea confirmada: {t['title']}", "")
-                        user2 = get_user(cur, u.id)
-                        if ttype == "campaign_link" and t["campaign_id"]:
-                            paid = try_pay_campaign_locked(cur, int(t["campaign_id"]), u.id, int(user2["level"]))
-
-                    streaked, streak, lvl = apply_streak_if_day_completed(cur, u.id, day)
-                    conn.commit()
-                    return inserted, paid, streaked, streak, lvl
-
-            inserted, paid, streaked, streak, lvl = await run_db(_confirm)
+            inserted, paid, streaked, streak, lvl = await _confirm()
+            invalidate_tasks_view(u.id, day)
 
             msg = "✅ **Tarea confirmada.**" if inserted else "⚠️ Ya estaba confirmada."
             if paid > 0:
@@ -1156,7 +1534,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if streaked:
                 msg += f"\n🔥 Racha: **{streak}** | 🏅 Nivel: **{lvl}**"
 
-            await q.edit_message_text(msg, parse_mode=ParseMode.MARKDOWN, reply_markup=next_after_task_kb(t["idx"]))
+            await edit_text(q, msg, next_after_task_kb(t["idx"]))
             return
 
         await q.answer("⚠️ Acción inválida.", show_alert=True)
@@ -1167,50 +1545,34 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ======================
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    msg = (update.message.text or "").strip()
-    if not msg:
-        return
+    text = update.message.text or ""
 
     # QUIZ ANSWER
     pending = context.user_data.get("pending_quiz")
     if isinstance(pending, dict):
+        msg = text.strip()
+        if not msg:
+            return
         task_id = int(pending.get("task_id", 0))
         day = today_local()
 
-        def _load_task():
-            with db_conn() as conn, conn.cursor() as cur:
-                ensure_user(cur, u)
-                cur.execute("SELECT * FROM daily_tasks WHERE id=%s", (task_id,))
-                t = cur.fetchone()
-                conn.commit()
-                return t
-
-        t = await run_db(_load_task)
+        t = await touch_user_and_get_task(u, context.user_data, day, task_id)
         if not t or t["day"] != day:
             context.user_data.pop("pending_quiz", None)
             await update.message.reply_text("⚠️ Ese quiz ya no es válido.", reply_markup=inline_menu(u.id))
             return
 
-        payload = (t.get("payload") or "").strip()
-        if payload.startswith("q=") and ";answer=" in payload:
-            expected = payload.split(";answer=", 1)[1].strip().lower()
-        else:
-            expected = payload.split("answer=")[-1].strip().lower()
-
-        if msg.lower().strip() != expected:
+        if msg.casefold() != (t.get("quiz_answer_casefold") or ""):
             await update.message.reply_text("❌ Incorrecto. Probá otra vez.")
             return
 
-        def _complete():
-            with db_conn() as conn, conn.cursor() as cur:
-                inserted = complete_task(cur, u.id, task_id)
-                if inserted:
-                    log_activity(cur, u.id, "task", f"✅ Tarea confirmada: {t['title']}", "")
-                streaked, streak, lvl = apply_streak_if_day_completed(cur, u.id, day)
-                conn.commit()
+        async def _complete():
+            async with db_autocommit() as conn, conn.cursor() as cur:
+                inserted, _, streaked, streak, lvl = await confirm_task(cur, u.id, task_id, t["title"], day)
                 return inserted, streaked, streak, lvl, t["idx"]
 
-        inserted, streaked, streak, lvl, idx = await run_db(_complete)
+        inserted, streaked, streak, lvl, idx = await _complete()
+        invalidate_tasks_view(u.id, day)
         context.user_data.pop("pending_quiz", None)
 
         out = "✅ **Tarea confirmada.**" if inserted else "⚠️ Ya estaba confirmada."
@@ -1224,10 +1586,12 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     admin_flow = context.user_data.get("admin_flow")
     if isinstance(admin_flow, dict) and is_admin(u.id):
         flow_type = admin_flow.get("type")
+        msg = text.strip()
 
         if flow_type == "add_task":
-            parts = [p.strip() for p in msg.split("|")]
-            if len(parts) < 3:
+            # maxsplit keeps "|" inside contenido (quiz "pregunta||respuesta")
+            parts = [p.strip() for p in msg.split("|", 3)]
+            if len(parts) < 3 or not all(parts[:3]):
                 await update.message.reply_text("⚠️ Usá: `emoji | titulo | tipo | contenido`", parse_mode=ParseMode.MARKDOWN)
                 return
 
@@ -1240,19 +1604,17 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("⚠️ Tipo inválido: checkin/quiz/link")
                 return
 
-            def _insert():
-                with db_conn() as conn, conn.cursor() as cur:
-                    cur.execute("""
+            async def _insert():
+                async with db_conn() as conn, conn.cursor() as cur:
+                    tid = await fetch_scalar(cur, """
                         INSERT INTO task_catalog (emoji, title, type, content, weight, is_active)
                         VALUES (%s,%s,%s,%s,10,TRUE)
                         RETURNING id
                     """, (emoji, title, ttype, content))
-                    tid = cur.fetchone()["id"]
-                    log_activity(cur, u.id, "admin", f"⚙️ Creó tarea #{tid}: {title}", "")
-                    conn.commit()
+                    await log_activity(cur, u.id, "admin", f"⚙️ Creó tarea #{tid}: {title}", "")
                     return tid
 
-            tid = await run_db(_insert)
+            tid = await _insert()
             context.user_data.pop("admin_flow", None)
             await update.message.reply_text(f"✅ Tarea creada #{tid}", reply_markup=inline_menu(u.id))
             return
@@ -1268,7 +1630,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             try:
                 budget_usd = float(parts[2].replace(",", "."))
                 goal = int(parts[3])
-            except Exception:
+            except ValueError:
                 await update.message.reply_text("⚠️ Presupuesto u objetivo inválidos.")
                 return
 
@@ -1277,57 +1639,61 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("⚠️ presupuesto y objetivo deben ser > 0.")
                 return
 
-            def _insert():
-                with db_conn() as conn, conn.cursor() as cur:
-                    cur.execute("UPDATE campaigns SET is_active=FALSE WHERE is_active=TRUE;")
-                    cur.execute("""
+            async def _insert():
+                async with db_conn() as conn, conn.cursor() as cur:
+                    # only one active campaign: deactivate the old ones and insert in one statement
+                    cid = await fetch_scalar(cur, """
+                        WITH off AS (
+                            UPDATE campaigns SET is_active=FALSE WHERE is_active=TRUE
+                        )
                         INSERT INTO campaigns (name, link_url, budget_usd_cents, goal_completions, is_active)
                         VALUES (%s,%s,%s,%s,TRUE)
                         RETURNING id
                     """, (name, link, budget_cents, goal))
-                    cid = cur.fetchone()["id"]
-                    log_activity(cur, u.id, "admin", f"⚙️ Creó campaña #{cid}: {name}", "")
-                    conn.commit()
+                    await log_activity(cur, u.id, "admin", f"⚙️ Creó campaña #{cid}: {name}", "")
                     return cid
 
-            cid = await run_db(_insert)
+            cid = await _insert()
             context.user_data.pop("admin_flow", None)
             await update.message.reply_text(f"✅ Campaña creada #{cid}", reply_markup=inline_menu(u.id))
             return
 
     # WITHDRAW DETAILS (si tiene retiro pendiente)
-    def _attach():
-        with db_conn() as conn, conn.cursor() as cur:
-            ensure_user(cur, u)
-            wrow = attach_withdrawal_details(cur, u.id, msg)
-            conn.commit()
-            return wrow
-
-    wrow = await run_db(_attach)
-    if wrow:
-        # notify ALL admins (not just one)
-        if ADMIN_IDS:
-            for admin_id in ADMIN_IDS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=(
-                            f"🔔 **Nuevo retiro pendiente**\n"
-                            f"Usuario: `{u.id}` (@{u.username})\n"
-                            f"Monto: **{format_usd_from_cents(wrow['amount_usd_cents'])}**\n"
-                            f"ID retiro: **#{wrow['id']}**\n\n"
-                            f"Datos:\n{msg}"
-                        ),
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                except Exception:
-                    pass
+    msg = text.strip()
+    if not msg:
+        return
 
-        await update.message.reply_text(
-            f"✅ Datos recibidos.\nTu retiro **#{wrow['id']}** quedó **pendiente**.",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=inline_menu(u.id)
+    await touch_user(u, context.user_data, today_local())
+
+    async def _attach():
+        async with db_conn() as conn, conn.cursor() as cur:
+            return await attach_withdrawal_details(cur, u.id, msg)
+
+    wrow = await _attach()
+    if wrow:
+        # notify ALL admins (not just one) and answer the user concurrently;
+        # admin notifications are best-effort
+        admin_text = (
+            f"🔔 **Nuevo retiro pendiente**\n"
+            f"Usuario: `{u.id}` (@{escape_markdown(u.username or '-')})\n"
+            f"Monto: **{format_usd_from_cents(wrow['amount_usd_cents'])}**\n"
+            f"ID retiro: **#{wrow['id']}**\n\n"
+            f"Datos:\n{escape_markdown(msg)}"
+        )
+        results = await asyncio.gather(
+            update.message.reply_text(
+                f"✅ Datos recibidos.\nTu retiro **#{wrow['id']}** quedó **pendiente**.",
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=inline_menu(u.id)
+            ),
+            *(
+                context.bot.send_message(chat_id=admin_id, text=admin_text, parse_mode=ParseMode.MARKDOWN)
+                for admin_id in ADMIN_IDS
+            ),
+            return_exceptions=True
         )
+        if isinstance(results[0], BaseException):
+            raise results[0]
         return
 
     await update.message.reply_text("📌 Tocá una opción del menú 👇", reply_markup=inline_menu(u.id))
@@ -1336,15 +1702,55 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ERROR HANDLER
 # ======================
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    if isinstance(context.error, PoolTimeout):
+        # every connection stayed busy for DB_POOL_TIMEOUT_S: tell the user instead of going silent
+        logging.warning("DB pool exhausted: %s", context.error)
+        if isinstance(update, Update) and update.effective_message:
+            with suppress(TelegramError):
+                await update.effective_message.reply_text("⏳ Hay mucha demanda ahora. Probá de nuevo en unos segundos.")
+        return
     logging.exception("Unhandled exception", exc_info=context.error)
 
+class OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest that parses Telegram's JSON replies with orjson instead of json.loads."""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            logging.exception("Can not load invalid JSON data: %r", payload)
+            raise TelegramError("Invalid server response") from exc
+
 # ======================
 # MAIN
 # ======================
 def main():
-    logging.basicConfig(level=logging.INFO)
+    # handlers on the event loop only enqueue records; a listener thread writes them to stderr
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+    log_listener = QueueListener(log_queue, logging.StreamHandler())
+    log_listener.start()
 
-    app = Application.builder().token(BOT_TOKEN).post_init(init_db).build()
+    # uvloop is optional (not available on Windows); run_polling/run_webhook pick up the policy
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(init_db)
+        .post_shutdown(close_db)
+    )
+    if orjson is not None:
+        # same pool sizes ApplicationBuilder uses by default
+        builder.request(OrjsonRequest(connection_pool_size=256))
+        builder.get_updates_request(OrjsonRequest(connection_pool_size=1))
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("whoami", cmd_whoami))
@@ -1360,7 +1766,20 @@ def main():
 
     app.add_error_handler(error_handler)
 
-    app.run_polling()
+    try:
+        if WEBHOOK_MODE:
+            # Telegram pushes updates to us; the secret doubles as the URL path and the header check
+            app.run_webhook(
+                listen="0.0.0.0",
+                port=PORT,
+                url_path=WEBHOOK_SECRET,
+                webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_SECRET}",
+                secret_token=WEBHOOK_SECRET,
+            )
+        else:
+            app.run_polling()
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file